@@ -35,6 +35,11 @@ class BackwardAnalyzer:
         self._running_lock = threading.Lock()
         self._running = False
 
+        # метка кнопки: последняя показанная и ожидающая показа в idle-колбэке
+        self._label_lock = threading.Lock()
+        self._shown_label: Optional[str] = "<|"
+        self._pending_label: Optional[str] = None
+
         # начальная метка
         try:
             self.button.set_label("<|")
@@ -55,7 +60,7 @@ class BackwardAnalyzer:
             self._stop_event.clear()
             self._step_event.clear()
             print("Setting the label in start")
-            GLib.idle_add(self._set_button_label, "…")
+            self._request_label("…")
             self.ggnv_threshold = self.get_ggnv_threshold()
             self._thread = threading.Thread(target=self._worker, daemon=True)
             self._thread.start()
@@ -73,7 +78,7 @@ class BackwardAnalyzer:
                 pass
             self._running = False
             print("Setting the label in stop")
-            GLib.idle_add(self._set_button_label, "<|")
+            self._request_label("<|")
 
     def toggle(self):
         if self.is_running():
@@ -86,6 +91,25 @@ class BackwardAnalyzer:
             return self._running
 
     # --- внутренние ---
+    def _request_label(self, text: str):
+        """Планирует смену метки; пока idle-колбэк не отработал, новые значения просто заменяют ожидающее."""
+        with self._label_lock:
+            if text == self._pending_label or (self._pending_label is None and text == self._shown_label):
+                return
+            first = self._pending_label is None
+            self._pending_label = text
+        if first:
+            GLib.idle_add(self._flush_label)
+
+    def _flush_label(self):
+        with self._label_lock:
+            text, self._pending_label = self._pending_label, None
+            if text is not None:
+                self._shown_label = text
+        if text is not None:
+            self._set_button_label(text)
+        return False
+
     def _set_button_label(self, text: str):
         try:
             self.button.set_label(text)
@@ -100,34 +124,41 @@ class BackwardAnalyzer:
             print("KatagoEngine not started")
             return None
 
+    def _ggnv(self, node) -> int:
+        """GGNV ноды как int; 0, если свойства нет или оно не парсится."""
+        try:
+            raw = (node.get_prop("GGNV") or [None])[0]
+            return int(raw) if raw is not None else 0
+        except Exception:
+            return 0
+
     def _node_path(self, node) -> List:
         path = []
         n = node
         while n is not None:
-            path.insert(0, n)
-            n = getattr(n, "parent", None)
+            path.append(n)
+            n = n.parent
+        path.reverse()
         return path
 
-    def _count_remaining(self, node) -> int:
-        """Считает ноды от node до root с GGNV < threshold."""
+    def _count_remaining(self, path: List) -> List[int]:
+        """
+        Для пути root..node возвращает counts, где counts[i] — число нод
+        от path[i] до root с GGNV < threshold. Считается один раз за проход.
+        """
+        counts = []
         cnt = 0
-        n = node
-        while n is not None:
-            try:
-                raw = (n.get_prop("GGNV") or [None])[0]
-                val = int(raw) if raw is not None else 0
-            except Exception:
-                val = 0
-            if val < self.ggnv_threshold:
+        for n in path:
+            if self._ggnv(n) < self.ggnv_threshold:
                 cnt += 1
-            n = getattr(n, "parent", None)
-        return cnt
+            counts.append(cnt)
+        return counts
 
     def _worker(self):
         kc = self._resolve_kc_once()
         if kc is None:
             print("Setting the label in worker start, kc is None")
-            GLib.idle_add(self._set_button_label, "<|")
+            self._request_label("<|")
             with self._running_lock:
                 self._running = False
             return
@@ -154,7 +185,7 @@ class BackwardAnalyzer:
         # если резолвер вернул None — завершаем
         if node is None:
             print("Setting the label in worker, resolver returned None")
-            GLib.idle_add(self._set_button_label, "<|")
+            self._request_label("<|")
             with self._running_lock:
                 self._running = False
             try:
@@ -163,27 +194,30 @@ class BackwardAnalyzer:
                 pass
             return
 
+        # дальше мы только поднимаемся к родителю, поэтому путь любой следующей
+        # ноды — префикс пути стартовой; путь и счётчики считаем один раз
+        start_path = self._node_path(node)
+        remaining_counts = self._count_remaining(start_path)
+        depth = len(start_path) - 1
+
         # основной цикл: пропускаем ноды с GGNV >= threshold (включая стартовую)
         while not (node is None or node.parent is None or self._stop_event.is_set()):
             print("Current node is", node)
             # если текущая нода уже проанализирована — пропускаем её сразу
-            try:
-                raw = (node.get_prop("GGNV") or [None])[0]
-                ggnv = int(raw) if raw is not None else 0
-            except Exception:
-                ggnv = 0
+            ggnv = self._ggnv(node)
 
             if ggnv >= self.ggnv_threshold:
-                node = getattr(node, "parent", None)
+                node = node.parent
+                depth -= 1
                 print("(1) Skipping the current with ggnv =", ggnv)
                 continue  # пропускаем и идём дальше
 
             # обновим метку кнопки — число оставшихся ходов (включая эту)
-            remaining = self._count_remaining(node)
-            GLib.idle_add(self._set_button_label, str(remaining))
+            remaining = remaining_counts[depth]
+            self._request_label(str(remaining))
 
             # синхронизируем движок на path и стартуем анализ
-            path = self._node_path(node)
+            path = start_path[:depth + 1]
             try:
                 kc.stop_sync_start(path, force_start=True)
             except Exception:
@@ -191,16 +225,13 @@ class BackwardAnalyzer:
                 pass
 
             # быстрый прямой чек GGNV
-            try:
-                raw = (node.get_prop("GGNV") or [None])[0]
-                ggnv = int(raw) if raw is not None else 0
-            except Exception:
-                ggnv = 0
+            ggnv = self._ggnv(node)
 
             if ggnv >= self.ggnv_threshold:
                 # если порог уже достигнут (включая случай, когда он был достигнут до старта анализа),
                 # просто переходим к родителю
-                node = getattr(node, "parent", None)
+                node = node.parent
+                depth -= 1
                 print("(2) Skipping the current with ggnv =", ggnv)
                 continue
 
@@ -213,32 +244,28 @@ class BackwardAnalyzer:
                 except Exception:
                     pass
                 ev.wait(timeout=self.per_node_timeout)
-                try:
-                    raw = (node.get_prop("GGNV") or [None])[0]
-                    ggnv = int(raw) if raw is not None else 0
-                except Exception:
-                    ggnv = 0
+                ggnv = self._ggnv(node)
                 reached = (ggnv >= self.ggnv_threshold)
                 print("(1) Reached is set to", reached)
             else:
                 print("fallback query node")
-                # fallback: опрос
+                # fallback: опрос с экспоненциальной задержкой 10 мс .. 400 мс;
+                # ждём на _stop_event, чтобы stop() будил сразу
                 t0 = time.time()
+                delay = 0.01
                 while time.time() - t0 < self.per_node_timeout and not self._stop_event.is_set():
-                    try:
-                        raw = (node.get_prop("GGNV") or [None])[0]
-                        if raw is not None and int(raw) >= self.ggnv_threshold:
-                            reached = True
-                            break
-                    except Exception:
-                        pass
-                    time.sleep(0.4)
+                    if self._ggnv(node) >= self.ggnv_threshold:
+                        reached = True
+                        break
+                    self._stop_event.wait(delay)
+                    delay = min(delay * 2, 0.4)
 
             if self._stop_event.is_set():
                 break
 
             if reached:
-                node = getattr(node, "parent", None)
+                node = node.parent
+                depth -= 1
             else:
                 print("Break on non reached")
                 break
@@ -250,6 +277,6 @@ class BackwardAnalyzer:
         except Exception:
             pass
         print("Setting the label in worker cleanup")
-        GLib.idle_add(self._set_button_label, "<|")
+        self._request_label("<|")
         with self._running_lock:
             self._running = False
@@ -1,15 +1,23 @@
 import re
+from io import StringIO
 
 path = './goban_gtk4_modular.py'
 with open(path, 'rt') as fp:
     data = fp.read()
 matcher_1 = re.compile(r'(?:[A-Z]+_)+[A-Z]+')
-constants = set(matcher_1.findall(data))
-# print(*constants, sep='\n')
-matcher_2 = re.compile('(?<!")(%s)(?!")'%('|'.join(
-    sorted(constants, key=len, reverse=True)
-)))
-replace_fn = lambda m:'DEFAULT_STYLE[\'%s\']'%(m.group(1).lower())
-data = matcher_2.sub(replace_fn, data)
+# every matcher_1 hit is one of the constants, so a single finditer pass both
+# finds and replaces them; the quote guard is a neighbour-char check
+out = StringIO()
+last = 0
+for m in matcher_1.finditer(data):
+    s, e = m.span()
+    if data[s - 1:s] == '"' or data[e:e + 1] == '"':
+        continue
+    # print(m.group(0))
+    out.write(data[last:s])
+    out.write('DEFAULT_STYLE[\'%s\']' % (m.group(0).lower()))
+    last = e
+out.write(data[last:])
+data = out.getvalue()
 with open(path, 'wt') as fp:
-    fp.write(data)
\ No newline at end of file
+    fp.write(data)
@@ -10,70 +10,268 @@
 #
 # Note: This is not a full SGF implementation but aims for consistent import/export
 # for typical SGF files used in this project.
+import functools
 import os
 from datetime import datetime, timezone
-from typing import List, Optional, Tuple, Dict, Any, Callable
+from typing import List, Optional, Tuple, Dict, Any, Callable, Sequence, Iterator
 import re
 import sys
+import threading
 
-DEBUG = True
+# diagnostic prints; set GGO_DEBUG to anything but empty or "0" to enable (read once at import)
+DEBUG = os.environ.get("GGO_DEBUG", "") not in ("", "0")
+
+# One SGF token per match: structural char | property id | bracketed value (escapes
+# kept; closing bracket optional so an unterminated value runs to the end) | any other
+# non-space char. Whitespace is skipped by finditer itself.
+_SGF_TOKEN_RE = re.compile(r"([();])|([A-Z]+)|\[((?:\\.|[^\\\]])*)\]?|(\S)", re.DOTALL)
+_SGF_UNESCAPE_RE = re.compile(r"\\(.)", re.DOTALL)
+# Same tokens for texts without any backslash (the usual case): a value is a plain
+# run up to ']', which the regex engine scans much faster than the escape alternation.
+_SGF_TOKEN_PLAIN_RE = re.compile(r"([();])|([A-Z]+)|\[([^\]]*)\]?|(\S)")
+# Escaping for written values: one translate pass instead of two replace calls.
+_ESCAPE_TABLE = str.maketrans({"\\": "\\\\", "]": "\\]"})
 
 
 # -------------------------
 # Node model
 # -------------------------
+# convert_move: SGF letters are 'a'-based; board columns skip 'I'
+_ORD_A_LOWER = ord('a')
+_ORD_A_UPPER = ord('A')
+_SKIP_I = ord('H') - _ORD_A_UPPER
+_COL_LETTERS = "ABCDEFGHJKLMNOPQRSTUVWXYZ"
+# every coordinate with a board column letter: sgf 'pd' -> ((row, col), column letter);
+# only the row number depends on board_size
+_SGF_COORDS: Dict[str, Tuple[Tuple[int, int], str]] = {
+    chr(_ORD_A_LOWER + col) + chr(_ORD_A_LOWER + row): ((row, col), letter)
+    for col, letter in enumerate(_COL_LETTERS)
+    for row in range(len(_COL_LETTERS))
+}
+# shared objects for parsed board coordinates, so all trees (and the _SGF_COORDS lookups)
+# use the same strings; read-only, other short values are kept as parsed
+_VAL_INTERN: Dict[str, str] = {coord: coord for coord in _SGF_COORDS}
+
+# bits of Node._flags
+_FLAG_VARIATION = 1
+_FLAG_CURRENT = 2
+# set by the serializer on every node it writes, cleared (with _sgf_cache) up the ancestor
+# chain by any mutation; a node without it implies all its ancestors are without it too
+_FLAG_SGF_CLEAN = 4
+
+
+class _TreeState:
+    """Change counters and lock of one tree, shared by all its nodes (Node._state)."""
+    __slots__ = ("generation", "shape_generation", "lock")
+
+    def __init__(self):
+        # bumped by every mutation made through Node methods; GameTree compares it to tell
+        # whether a cached serialization is still current
+        self.generation: int = 0
+        # bumped only by changes to the tree shape (children added, variation flags); props
+        # edits leave it alone, so caches of the mainline survive analysis updates
+        self.shape_generation: int = 0
+        # held by Node mutators for the change plus the cache invalidation, by to_sgf for the
+        # whole write and while installing a built Node._index: set_prop runs on the engine
+        # thread while the UI serializes, and the serializer must not cache text built from
+        # props that change under it
+        self.lock = threading.RLock()
+
+
 class Node:
     """
     Represents a single SGF node (a semicolon entry).
-    - props: list of (key, [values]) preserving insertion order and multiple values
-    - children: list of Node children (variations / mainline continuation)
+    - props: list of (key, (values...)) preserving insertion order and multiple values;
+      value groups are immutable tuples
+    - children: Node children (variations / mainline continuation); the shared empty
+      tuple until the first child is attached with _add_child
     - parent: optional parent Node
     - _is_variation: True if this node was created as a variation (inside parentheses)
+    - is_current: True for the nodes on the path to the current node
+      (both flags are bits of the _flags slot, exposed as properties)
+    - analysis_results: engine results for this node; the dict is created on first access
+    - _mainline_child: first child that is not a variation (kept by _add_child / _is_variation)
+    - _depth: number of edges from the synthetic root
+    - _state: the _TreeState of the tree, taken from the parent (a new one for a node without)
+    Once get_prop has been used, change props of a node through set_prop / add_prop_value
+    so the lazy key index stays valid.
     """
     __slots__ = (
         "props",
         "children",
         "parent",
-        "_is_variation",
-        "is_current",
-        "analysis_results",
+        "_flags",
+        "_analysis_results",
+        "_index",
+        "_mainline_child",
+        "_depth",
+        "_sgf_cache",
+        "_current_child",
+        "_state",
     )
 
     def __init__(self, parent: Optional["Node"] = None, is_variation: bool = False):
-        # props as list of (key, [values]) to preserve order and duplicates
-        self.props: List[Tuple[str, List[str]]] = []
-        self.children: List["Node"] = []
+        # props as list of (key, (values...)) to preserve order and duplicates
+        self.props: List[Tuple[str, Tuple[str, ...]]] = []
+        # most nodes are leaves or have one child: no list until a child is attached
+        self.children: Sequence["Node"] = ()
         self.parent: Optional["Node"] = parent
-        self._is_variation: bool = is_variation
-        self.is_current: bool = False
-        self.analysis_results: dict = {}
+        # _is_variation / is_current bits, always set (properties below, no getattr default)
+        self._flags: int = _FLAG_VARIATION if is_variation else 0
+        # analysis_results dict, allocated on first access (most nodes are never analysed)
+        self._analysis_results: Optional[dict] = None
+        # key -> position of its first occurrence in props, built on first lookup and
+        # then kept up to date by set_prop / add_prop_value
+        self._index: Optional[Dict[str, int]] = None
+        self._mainline_child: Optional["Node"] = None
+        self._depth: int = parent._depth + 1 if parent is not None else 0
+        # for variation roots and top-level nodes: (SGF text of the mainline written from this
+        # node, the variation roots hanging off that mainline); see GameTree._write_subtree
+        self._sgf_cache: Optional[Tuple[str, Tuple["Node", ...]]] = None
+        # the child whose is_current was set last, kept by the is_current setter
+        self._current_child: Optional["Node"] = None
+        self._state: _TreeState = parent._state if parent is not None else _TreeState()
+
+    def _build_index(self) -> Dict[str, int]:
+        index: Dict[str, int] = {}
+        for idx, (k, vals) in enumerate(self.props):
+            if k not in index:
+                index[k] = idx
+        # props are read (get_prop) and written (set_prop) from different threads: if another
+        # thread installed an index meanwhile, keep it, since set_prop may already have extended it
+        with self._state.lock:
+            if self._index is None:
+                self._index = index
+            return self._index
+
+    def _invalidate_sgf(self) -> None:
+        # drop cached subtree text here and on every ancestor; stops at the first node that
+        # is not clean, since its ancestors were already invalidated
+        n = self
+        while n is not None and n._flags & _FLAG_SGF_CLEAN:
+            n._flags &= ~_FLAG_SGF_CLEAN
+            n._sgf_cache = None
+            n = n.parent
+
+    def _add_child(self, child: "Node") -> None:
+        state = self._state
+        with state.lock:
+            if child._state is not state:
+                # a subtree built on its own joins this tree
+                stack = [child]
+                while stack:
+                    n = stack.pop()
+                    n._state = state
+                    stack.extend(n.children)
+            if self.children:
+                self.children.append(child)
+            else:
+                self.children = [child]
+            if self._mainline_child is None and not child._flags & _FLAG_VARIATION:
+                self._mainline_child = child
+            self._changed(True)
+
+    def _changed(self, shape: bool = False) -> None:
+        # after a mutation, with the tree lock held: only now are the caches stale
+        state = self._state
+        state.generation += 1
+        if shape:
+            state.shape_generation += 1
+        self._invalidate_sgf()
 
-    # convenience: get property values (first occurrence) or None
-    def get_prop(self, key: str) -> Optional[List[str]]:
-        for k, vals in self.props:
-            if k == key:
-                return vals
-        return None
+    @property
+    def _is_variation(self) -> bool:
+        return bool(self._flags & _FLAG_VARIATION)
+
+    @_is_variation.setter
+    def _is_variation(self, value: bool) -> None:
+        # normalize_is_variation sets every flag before each save: an unchanged flag must
+        # not count as a change, or the SGF caches would never be reused
+        if bool(self._flags & _FLAG_VARIATION) == bool(value):
+            return
+        with self._state.lock:
+            if value:
+                self._flags |= _FLAG_VARIATION
+            else:
+                self._flags &= ~_FLAG_VARIATION
+            # the parent's mainline child is its first non-variation child
+            parent = self.parent
+            if parent is not None:
+                parent._mainline_child = next(
+                    (c for c in parent.children if not c._flags & _FLAG_VARIATION), None)
+            self._changed(True)
 
-    def set_prop(self, key: str, values: List[str]):
-        # replace existing first occurrence
-        for idx, (k, vals) in enumerate(self.props):
-            if k == key:
-                self.props[idx] = (key, list(values))
-                return
-        self.props.append((key, list(values)))
+    @property
+    def analysis_results(self) -> dict:
+        results = self._analysis_results
+        if results is None:
+            results = self._analysis_results = {}
+        return results
+
+    @analysis_results.setter
+    def analysis_results(self, value: dict) -> None:
+        self._analysis_results = value
+
+    @property
+    def is_current(self) -> bool:
+        return bool(self._flags & _FLAG_CURRENT)
+
+    @is_current.setter
+    def is_current(self, value: bool) -> None:
+        parent = self.parent
+        if value:
+            self._flags |= _FLAG_CURRENT
+            if parent is not None:
+                parent._current_child = self
+        else:
+            self._flags &= ~_FLAG_CURRENT
+            if parent is not None and parent._current_child is self:
+                parent._current_child = None
+
+    # convenience: get property values (first occurrence) or None
+    def get_prop(self, key: str) -> Optional[Tuple[str, ...]]:
+        idx = (self._index if self._index is not None else self._build_index()).get(key)
+        return self.props[idx][1] if idx is not None else None
+
+    def set_prop(self, key: str, values: Sequence[str]):
+        # same shared key objects as the parser produces
+        key = sys.intern(key)
+        with self._state.lock:
+            index = self._index if self._index is not None else self._build_index()
+            idx = index.get(key)
+            if idx is not None:
+                # replace existing first occurrence
+                self.props[idx] = (key, tuple(values))
+            else:
+                # append before indexing it, so a concurrent get_prop never sees a position past the end
+                self.props.append((key, tuple(values)))
+                index[key] = len(self.props) - 1
+            self._changed()
 
     def add_prop_value(self, key: str, value: str):
-        for idx, (k, vals) in enumerate(self.props):
-            if k == key:
-                vals.append(value)
-                self.props[idx] = (k, vals)
-                return
-        self.props.append((key, [value]))
+        # same shared key objects as the parser produces
+        key = sys.intern(key)
+        with self._state.lock:
+            index = self._index if self._index is not None else self._build_index()
+            idx = index.get(key)
+            if idx is not None:
+                k, vals = self.props[idx]
+                self.props[idx] = (k, tuple(vals) + (value,))
+            else:
+                self.props.append((key, (value,)))
+                index[key] = len(self.props) - 1
+            self._changed()
 
     def props_dict(self) -> Dict[str, List[str]]:
-        d: Dict[str, List[str]] = {}
-        for k, vals in self.props:
+        """Values of each key merged over its occurrences, as a new dict the caller may change."""
+        props = self.props
+        # usual case: every key occurs once, so a comprehension is the whole result
+        d = {k: list(vals) for k, vals in props}
+        if len(d) == len(props):
+            return d
+        # repeated keys: merge their values in order
+        d = {}
+        for k, vals in props:
             if k in d:
                 d[k].extend(vals)
             else:
@@ -81,22 +279,33 @@ class Node:
         return d
 
     def has_move(self) -> bool:
-        pd = self.props_dict()
-        return any(
-            color in pd and pd[color] and any(pd[color])
-            for color in ["B", "W"]
-        )
+        # B/W may repeat; any non-empty value in any occurrence counts
+        for k, vals in self.props:
+            if (k == "B" or k == "W") and any(vals):
+                return True
+        return False
 
     def __repr__(self):
-        pd = self.props_dict()
+        # one pass over props: distinct keys in order, merged B / W values
+        keys: List[str] = []
+        b: Optional[List[str]] = None
+        w: Optional[List[str]] = None
+        for k, vals in self.props:
+            if k not in keys:
+                keys.append(k)
+            if k == "B":
+                b = list(vals) if b is None else b + list(vals)
+            elif k == "W":
+                w = list(vals) if w is None else w + list(vals)
         mv = None
-        if "B" in pd:
-            mv = f"B {pd['B']}"
-        elif "W" in pd:
-            mv = f"W {pd['W']}"
-        return f"<Node move={mv} props={{{', '.join(pd.keys())}}} children={len(self.children)}>"
+        if b is not None:
+            mv = f"B {b}"
+        elif w is not None:
+            mv = f"W {w}"
+        return f"<Node move={mv} props={{{', '.join(keys)}}} children={len(self.children)}>"
 
     def set_is_variation(self, is_variation: bool) -> None:
+        # the property setter bumps the generations and refreshes the parent's _mainline_child
         self._is_variation = is_variation
 
     def get_moves(self, board_size: int = 19) -> List[Tuple[str, str, Tuple[int, int], str]]:
@@ -107,11 +316,16 @@ class Node:
 
     def convert_move(self, _get_move_result: Tuple[str, str], board_size: int) -> Tuple[str, str | None, Tuple[int, int] | None, str | None]:
         color, sgf_move_notation = _get_move_result
+        hit = _SGF_COORDS.get(sgf_move_notation)
+        if hit is not None:
+            row_col, col_coord_notation = hit
+            return color, sgf_move_notation, row_col, f"{col_coord_notation}{board_size - row_col[0]}"
+        # passes and anything outside a-y
         if len(sgf_move_notation) != 2:
             return color, None, None, None
-        col = ord(sgf_move_notation[0]) - ord('a')
-        row = ord(sgf_move_notation[1]) - ord('a')
-        col_coord_notation = chr(ord('A') + col + int(col > ord('H') - ord('A')))
+        col = ord(sgf_move_notation[0]) - _ORD_A_LOWER
+        row = ord(sgf_move_notation[1]) - _ORD_A_LOWER
+        col_coord_notation = chr(_ORD_A_UPPER + col + int(col > _SKIP_I))
         board_coord_notation = f"{col_coord_notation}{board_size - row}"
         return color, sgf_move_notation, (row, col), board_coord_notation
 
@@ -122,33 +336,55 @@ class Node:
                 result.extend((k, val) for val in vals)
         return result
 
+
+# TOML reader, chosen once at import: tomllib (py3.11+), else the toml package, else none
+try:
+    import tomllib
+
+    def _toml_load(path: str) -> dict:
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+except ImportError:
+    try:
+        import toml
+
+        def _toml_load(path: str) -> dict:
+            with open(path, "r", encoding="utf-8") as f:
+                return toml.load(f)
+    except ImportError:
+        _toml_load = None
+
+
+@functools.lru_cache(maxsize=4)
+def _load_pyproject(path: str, mtime: Optional[float]) -> dict:
+    """
+    Parsed pyproject.toml at an absolute path, {} if missing (mtime None) or unreadable.
+    Cached per (path, mtime): the file is parsed again only after it changes; treat the
+    result as read-only.
+    """
+    if _toml_load is None or mtime is None:
+        return {}
+    try:
+        return _toml_load(path)
+    except Exception as e:
+        print("[get_name_and_version_from_toml_path] failed to load pyproject.toml:", path, e)
+        return {}
+
+
 def get_name_and_version_from_toml_path(path: str = "../pyproject.toml") -> tuple[Any, Any]:
     name = None
     version = None
 
-    print("[get_name_and_version_from_toml_path] reading ", path, " at", os.getcwd())
+    if DEBUG:
+        print("[get_name_and_version_from_toml_path] reading ", path, " at", os.getcwd())
     try:
-        # try tomllib (py3.11+) then toml
+        # relative paths depend on the cwd, so the cache is keyed on the absolute one
+        abspath = os.path.abspath(path)
         try:
-            import tomllib
-            if os.path.exists(path):
-                with open(path, "rb") as f:
-                    data = tomllib.load(f)
-            else:
-                data = {}
-        except Exception as e:
-            print("[get_name_and_version_from_toml_path] failed to load pyproject.toml:", path, e)
-            # try toml package
-            try:
-                import toml
-                if os.path.exists(path):
-                    with open(path, "r", encoding="utf-8") as f:
-                        data = toml.load(f)
-                else:
-                    data = {}
-            except Exception as e:
-                print("[get_name_and_version_from_toml_path] failed to load pyproject.toml:", path, e)
-                data = {}
+            mtime: Optional[float] = os.path.getmtime(abspath)
+        except OSError:
+            mtime = None
+        data = _load_pyproject(abspath, mtime)
         # project table may be under 'project' (PEP 621) or under 'tool.poetry'
         if isinstance(data, dict):
             proj = data.get("project")
@@ -169,6 +405,113 @@ def get_name_and_version_from_toml_path(path: str = "../pyproject.toml") -> tupl
     return name, version
 
 
+def _get_header(path: str = "../pyproject.toml") -> Tuple[Tuple[str, Tuple[str, ...]], ...]:
+    """
+    Canonical SGF header props except DT, in header order, as (key, (value,)) pairs.
+    pyproject.toml is parsed again only after it changes (see _load_pyproject).
+    """
+    name, version = get_name_and_version_from_toml_path(path)
+    if name and version:
+        ap_val = f"{name}:{version}"
+    elif name:
+        ap_val = f"{name}:0.0"
+    else:
+        ap_val = "ggo:0.1"
+    return (
+        ("GM", ("1",)),
+        ("FF", ("4",)),
+        ("CA", ("UTF-8",)),
+        ("AP", (ap_val,)),
+        ("KM", ("6.5",)),
+        ("SZ", ("19",)),
+    )
+
+
+def _utc_date() -> str:
+    try:
+        return datetime.now(timezone.utc).date().isoformat()
+    except Exception:
+        return ""
+
+
+# -------------------------
+# SGF event stream
+# -------------------------
+_EV_OPEN_VAR = ("open_var",)
+_EV_CLOSE_VAR = ("close_var",)
+_EV_NODE = ("node",)
+
+
+def iter_sgf_events(sgf_text: str, coords: Optional[Dict[str, str]] = None) -> Iterator[Tuple]:
+    """
+    Tokenize SGF text into a flat stream of events, without building Node objects:
+    - ('open_var',) for '(' and ('close_var',) for ')'
+    - ('node',) for each ';'
+    - ('prop', key, values) for each property of the current node; values is a tuple of
+      unescaped strings. Properties outside a node (e.g. right after '(') are dropped.
+    A '[' that does not follow a property identifier or value is skipped on its own and
+    the text after it is read as tokens, so '(;B[aa])[;W[bb]]' still yields the W node.
+    coords maps short values (board coordinates) to the shared object to use for them;
+    by default the module-wide _VAL_INTERN table. It is only read: values not in it are
+    kept as parsed.
+    GameTree.load_sgf_simple builds its tree from these events; callers that only need a
+    single pass (counting moves, replaying a board) can consume them directly.
+    """
+    if coords is None:
+        coords = _VAL_INTERN
+    # properties are only read between a ';' and the next '(' / ')'
+    in_node = False
+    # property being read and its values so far; values is None when a '[' would be stray
+    prop_id = ""
+    values: Optional[List[str]] = None
+    # one C-level scan decides whether any value can contain an escape at all
+    has_escapes = "\\" in sgf_text
+    token_re = _SGF_TOKEN_RE if has_escapes else _SGF_TOKEN_PLAIN_RE
+    # locals for the loop below (LOAD_FAST instead of global / attribute lookups)
+    unescape = _SGF_UNESCAPE_RE.sub
+    intern = sys.intern
+
+    pos = 0
+    while True:
+        for m in token_re.finditer(sgf_text, pos):
+            kind = m.lastindex
+            if kind == 3:
+                if values is None:
+                    # stray '[': skip just that char and scan again from the next one
+                    pos = m.start() + 1
+                    break
+                # bracketed value of the current property
+                val = m.group(3)
+                if has_escapes and "\\" in val:
+                    val = unescape(r"\1", val)
+                elif len(val) <= 2:
+                    # move/stone coordinates repeat all over a game: keep one copy of each
+                    val = coords.get(val, val)
+                values.append(val)
+                continue
+            # any other token ends the values of the current property
+            if values is not None:
+                yield ("prop", prop_id, tuple(values))
+                values = None
+            if kind == 2:
+                # property identifier: values follow
+                if in_node:
+                    prop_id = intern(m.group(2))
+                    values = []
+            elif kind == 1:
+                ch = m.group(1)
+                if ch == ";":
+                    in_node = True
+                    yield _EV_NODE
+                else:
+                    in_node = False
+                    yield _EV_OPEN_VAR if ch == "(" else _EV_CLOSE_VAR
+        else:
+            break
+    if values is not None:
+        yield ("prop", prop_id, tuple(values))
+
+
 # -------------------------
 # GameTree wrapper
 # -------------------------
@@ -183,7 +526,26 @@ class GameTree:
     def __init__(self):
         self.root: Node = Node(parent=None)
         self._current = None
-        self._subs = []
+        # subscribers as an ordered set: keys are the callbacks themselves (bound methods
+        # are recreated on each attribute access, so they are matched by equality, not id)
+        self._subs: Dict[Callable, None] = {}
+        # last path computed by get_node_path (nodes from a top-level node down)
+        self._path_cache: Optional[List[Node]] = None
+        # (shape generation, root, node) of the last find_last_mainline_node() result
+        self._last_mainline: Optional[Tuple[int, Node, Optional[Node]]] = None
+        # (generation, root, text) of the last to_sgf() result; generations of root._state
+        self._sgf_cache: Optional[Tuple[int, Node, str]] = None
+
+    def touch(self):
+        """Drop the cached SGF (whole text and per-subtree) after edits that bypass the Node mutation methods."""
+        with self.root._state.lock:
+            self._sgf_cache = None
+            stack = [self.root]
+            while stack:
+                n = stack.pop()
+                n._flags &= ~_FLAG_SGF_CLEAN
+                n._sgf_cache = None
+                stack.extend(n.children)
 
     # -------------------------
     # Parsing
@@ -192,106 +554,57 @@ class GameTree:
         """
         Parse SGF text into the GameTree structure.
         This parser:
-        - tokenizes parentheses '(', ')', semicolons ';', property identifiers and bracketed values.
-        - creates a Node for each ';' token and attaches properties parsed after it.
+        - consumes the iter_sgf_events stream (the one SGF tokenizer of this module).
+        - creates a Node for each ('node',) event and attaches the properties that follow it.
         - handles nested variations by using a stack of parent contexts; marks nodes created inside
           parentheses as variations so serializer can preserve mainline vs variations.
         """
-        text = sgf_text
-        i = 0
-        n = len(text)
-
-        def read_bracket_value(idx: int) -> Tuple[str, int]:
-            # assumes text[idx] == '['
-            idx += 1
-            buf_chars = []
-            while idx < n:
-                ch = text[idx]
-                if ch == "\\":
-                    # escape next char (including newline)
-                    idx += 1
-                    if idx < n:
-                        buf_chars.append(text[idx])
-                        idx += 1
-                    continue
-                if ch == "]":
-                    idx += 1
-                    break
-                buf_chars.append(ch)
-                idx += 1
-            return ("".join(buf_chars), idx)
-
         # stack holds tuples (parent_node, in_variation_flag)
         # parent_node: the node under which new nodes should be appended when a ';' is seen
         # in_variation_flag: True if this stack frame corresponds to a '(' context (variation)
         stack: List[Tuple[Node, bool]] = [(self.root, False)]
         current_node: Optional[Node] = None
+        # locals for the loop below (LOAD_FAST instead of global / attribute lookups)
+        new_node = Node
+        push = stack.append
+        pop = stack.pop
 
-        prop_re = re.compile(r"[A-Z]+")
-        while i < n:
-            ch = text[i]
-            if ch == "(":
+        for ev in iter_sgf_events(sgf_text):
+            if ev is _EV_NODE:
+                # create a new node
+                parent = current_node if current_node is not None else stack[-1][0]
+                is_variation = (current_node is None and stack[-1][1] is True)
+                node = new_node(parent, is_variation)
+                # attached directly, not through _add_child: parents are the synthetic
+                # root or nodes made by this call, so no cache can refer to them; the
+                # generations are bumped once at the end
+                if parent.children:
+                    parent.children.append(node)
+                else:
+                    parent.children = [node]
+                if parent._mainline_child is None and not is_variation:
+                    parent._mainline_child = node
+                current_node = node
+            elif ev is _EV_OPEN_VAR:
                 # start a new variation: push a frame
                 parent_for_variation = current_node if current_node is not None else stack[-1][0]
-                stack.append((parent_for_variation, True))
+                push((parent_for_variation, True))
                 current_node = None
-                i += 1
-            elif ch == ")":
+            elif ev is _EV_CLOSE_VAR:
                 # end current variation: pop stack and restore current_node to the parent_for_variation
                 if len(stack) > 1:
-                    popped_parent, popped_flag = stack.pop()
+                    popped_parent, popped_flag = pop()
                     current_node = popped_parent
                 else:
                     current_node = None
-                i += 1
-            elif ch == ";":
-                # create a new node
-                parent = current_node if current_node is not None else stack[-1][0]
-                is_variation = (current_node is None and stack[-1][1] is True)
-                node = Node(parent=parent, is_variation=is_variation)
-                if parent is not None:
-                    parent.children.append(node)
-                current_node = node
-                i += 1
-                # skip whitespace
-                while i < n and text[i].isspace():
-                    i += 1
-                # parse properties for this node
-                while i < n:
-                    if text[i].isspace():
-                        i += 1
-                        continue
-                    if text[i] in ";()":
-                        break
-                    m = prop_re.match(text, i)
-                    if not m:
-                        # unexpected char, skip
-                        i += 1
-                        continue
-                    prop_id = m.group(0)
-                    i = m.end()
-                    # skip whitespace
-                    while i < n and text[i].isspace():
-                        i += 1
-                    values: List[str] = []
-                    # read one or more bracketed values
-                    while i < n and text[i] == "[":
-                        val, i = read_bracket_value(i)
-                        values.append(val)
-                        while i < n and text[i].isspace():
-                            i += 1
-                    # attach property to current_node
-                    if current_node is None:
-                        parent = stack[-1][0] if stack else self.root
-                        current_node = Node(parent=parent, is_variation=stack[-1][1])
-                        parent.children.append(current_node)
-                    current_node.props.append((prop_id, values))
-                # continue outer loop
             else:
-                # skip other characters
-                i += 1
+                # ('prop', key, values): only yielded between a node and the next '(' / ')'
+                current_node.props.append(ev[1:])
 
-        # parsing finished
+        # parsing finished: one change for the whole load
+        with self.root._state.lock:
+            self.root._changed(True)
+            self._sgf_cache = None
         self._emit("tree_changed", None)
         return
 
@@ -303,48 +616,75 @@ class GameTree:
         Return list of nodes from synthetic root (excluded) down to the given node.
         If node is not attached to this tree, returns empty list.
         """
-        path: List[Node] = []
+        if node is None:
+            return []
+        # Parents never change once a node is attached, so the last returned path stays valid
+        # and any node on it is found by depth: climb only until the cached path is reached.
+        cached = self._path_cache
+        if cached is not None and cached[0].parent is not self.root:
+            cached = None
+        below: List[Node] = []
         cur = node
-        # climb up until we reach synthetic root or None
-        while cur is not None and cur is not self.root:
-            path.append(cur)
+        while True:
+            if cur is None:
+                # node not in this tree
+                return []
+            if cur is self.root:
+                path: List[Node] = []
+                break
+            d = cur._depth
+            if cached is not None and d <= len(cached) and cached[d - 1] is cur:
+                path = cached[:d]
+                break
+            below.append(cur)
             cur = cur.parent
-        if cur is not self.root:
-            # node not in this tree
-            return []
-        path.reverse()
-        return path
+        if below:
+            below.reverse()
+            path.extend(below)
+        if path:
+            self._path_cache = path
+        # callers may extend the result: hand out a copy
+        return path[:]
 
     def find_last_mainline_node(self) -> Optional[Node]:
         """
         Find the last node on the mainline starting from the first top-level child.
         Mainline is defined as following the first non-variation child at each step.
+        The result is cached until the tree shape changes; add_move / add_variation keep it current.
         """
-        if not self.root.children:
-            return None
-        cur = self.root.children[0]
-        while True:
-            # choose first child that is not a variation
-            next_child = None
-            for c in cur.children:
-                if not getattr(c, "_is_variation", False):
-                    next_child = c
-                    break
-            if next_child is None:
-                return cur
-            cur = next_child
+        cache = self._last_mainline
+        generation = self.root._state.shape_generation
+        if cache is not None and cache[0] == generation and cache[1] is self.root:
+            return cache[2]
+        last = None
+        if self.root.children:
+            last = self.root.children[0]
+            while last._mainline_child is not None:
+                last = last._mainline_child
+        self._last_mainline = (generation, self.root, last)
+        return last
+
+    def _last_mainline_if_cached(self) -> Optional[Node]:
+        # cached last mainline node if the cache is still current, else None
+        cache = self._last_mainline
+        if cache is not None and cache[0] == self.root._state.shape_generation and cache[1] is self.root:
+            return cache[2]
+        return None
 
     # -------------------------
     # Mutation API (for UI/controller)
     # -------------------------
     def add_move(self, parent: Optional[Node], color: str = None, coord: str = None, *,
-                 props: Optional[Any] = None, is_variation: Optional[bool] = None) -> Node:
+                 props: Optional[Any] = None, is_variation: Optional[bool] = None,
+                 raw_props: Optional[Sequence[Tuple[str, Tuple[str, ...]]]] = None) -> Node:
         """
         Add a move node as a child of `parent`.
         Backwards-compatible:
           - old callers: add_move(parent, "B", "pd")
           - new callers: add_move(parent=..., props=[("AB", ["pd"]), ("AB", ["dd"]), ("AW", ["qq"])])
           - or: add_move(parent=..., props={"AB": ["pd","dd"], "AW": ["qq"]})
+          - fast path: add_move(parent=..., raw_props=[("AB", ("pd", "dd"))]) takes (key, tuple of str)
+            pairs as they are, without the coercion applied to props
         If parent is None, append to the last mainline node (or create top-level if empty).
         Returns the created Node.
         """
@@ -362,10 +702,12 @@ class GameTree:
 
         # attach move from (color, coord) if provided
         if color is not None and coord is not None:
-            node.props.append((color, [coord]))
+            node.props.append((color, (coord,)))
 
         # attach props if provided
-        if props:
+        if raw_props is not None:
+            node.props.extend(raw_props)
+        elif props:
             # Preferred form: list of (key, values) pairs to preserve duplicates/order
             if isinstance(props, (list, tuple)):
                 for item in props:
@@ -375,24 +717,28 @@ class GameTree:
                     k = item[0]
                     v = item[1] if len(item) > 1 else []
                     if isinstance(v, (list, tuple)):
-                        vals = [str(x) for x in v]
+                        vals = tuple(str(x) for x in v)
                     else:
-                        vals = [str(v)]
+                        vals = (str(v),)
                     # append each occurrence as a single property entry (preserves duplicates)
                     node.props.append((k, vals))
             elif isinstance(props, dict):
                 # dict: values may be lists; order is dict order (Python 3.7+ preserves insertion order)
                 for k, v in props.items():
                     if isinstance(v, (list, tuple)):
-                        vals = [str(x) for x in v]
+                        vals = tuple(str(x) for x in v)
                     else:
-                        vals = [str(v)]
+                        vals = (str(v),)
                     node.props.append((k, vals))
             else:
                 # unsupported type — ignore
                 pass
 
-        parent.children.append(node)
+        # appending a mainline move to the last mainline node moves the mainline end to it
+        extends_mainline = not is_variation and parent is self._last_mainline_if_cached()
+        parent._add_child(node)
+        if extends_mainline:
+            self._last_mainline = (self.root._state.shape_generation, self.root, node)
         self._emit("tree_changed", None)
         return node
 
@@ -406,76 +752,156 @@ class GameTree:
         if color not in ("B", "W"):
             raise ValueError("color must be 'B' or 'W'")
         node = Node(parent=parent, is_variation=True)
-        node.props.append((color, [coord]))
-        parent.children.append(node)
+        node.props.append((color, (coord,)))
+        # a variation never changes the mainline: keep a current cache current
+        last = self._last_mainline_if_cached()
+        parent._add_child(node)
+        if last is not None:
+            self._last_mainline = (self.root._state.shape_generation, self.root, last)
         return node
 
     # -------------------------
     # Serialization
     # -------------------------
     def _escape_value(self, v: str) -> str:
-        v = v.replace("\\", "\\\\")
-        v = v.replace("]", "\\]")
-        return v
+        # fast path: most values (coordinates) have nothing to escape
+        if "\\" not in v and "]" not in v:
+            return v
+        return v.translate(_ESCAPE_TABLE)
 
     def _serialize_node_props(self, node: Node) -> str:
-        parts: List[str] = []
-        for key, vals in node.props:
-            if not vals:
-                parts.append(f"{key}")
-                continue
-            vs = "".join(f"[{self._escape_value(v)}]" for v in vals)
-            parts.append(f"{key}{vs}")
-        return "".join(parts)
+        props = node.props
+        # fast path: the usual move node, a single property with one plain value (B[pd])
+        if len(props) == 1:
+            key, vals = props[0]
+            if len(vals) == 1:
+                v = vals[0]
+                if "\\" not in v and "]" not in v:
+                    return key + "[" + v + "]"
+        # one flat list for all keys and values, joined once
+        esc = self._escape_value
+        out: List[str] = []
+        append = out.append
+        for key, vals in props:
+            append(key)
+            for v in vals:
+                append("[")
+                append(esc(v))
+                append("]")
+        return "".join(out)
 
     def _serialize_subtree(self, node: Node) -> str:
+        """Serialize a subtree starting at node into SGF (see _write_subtree)."""
+        out: List[str] = []
+        self._write_subtree(node, out)
+        return "".join(out)
+
+    def _write_subtree(self, node: Node, out: List[str]) -> None:
         """
-        Serialize a subtree starting at node into SGF.
+        Append the SGF of the subtree starting at node to out.
         Serializes the mainline (first non-variation child chain) inline and emits additional children as variations.
+        Variations are handled with an explicit stack, so deep nesting does not recurse.
+        node and each variation root keep the text of their own mainline (not of the variations
+        below it, so every node's text is cached once) in _sgf_cache, reused until a mutation
+        below invalidates it (see Node._invalidate_sgf).
         """
-        # Build mainline: follow the first child that is NOT marked as variation.
-        seq_parts: List[str] = []
-        mainline_nodes: List[Node] = []
-        cur = node
+        # stack items: a Node whose subtree is still to be written, or a literal "(" / ")"
+        stack: List[Any] = [node]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                out.append(item)
+                continue
+            cache = item._sgf_cache
+            if cache is None:
+                cache = item._sgf_cache = self._serialize_mainline(item)
+            text, variations = cache
+            out.append(text)
+            for c in reversed(variations):
+                stack.append(")")
+                stack.append(c)
+                stack.append("(")
+
+    def _serialize_mainline(self, item: Node) -> Tuple[str, Tuple[Node, ...]]:
+        # Single pass down the mainline (the first child NOT marked as variation), collecting
+        # every other child of each mainline node as a variation, in order. The nodes written
+        # get the clean bit, so a change to any of them clears item._sgf_cache.
+        parts: List[str] = []
+        variations: List[Node] = []
+        cur = item
         while cur is not None:
-            props_str = self._serialize_node_props(cur)
-            seq_parts.append(";" + props_str)
-            mainline_nodes.append(cur)
-            # find mainline child: first child with _is_variation == False
-            main_child = None
+            cur._flags |= _FLAG_SGF_CLEAN
+            parts.append(";")
+            parts.append(self._serialize_node_props(cur))
+            # mainline child: first child with _is_variation == False (cached on the node)
+            main_child = cur._mainline_child
             for c in cur.children:
-                if not getattr(c, "_is_variation", False):
-                    main_child = c
-                    break
+                if c is not main_child:
+                    variations.append(c)
             cur = main_child
-
-        mainline = "".join(seq_parts)
-
-        # collect variations attached to any node in the mainline
-        var_parts: List[str] = []
-        for mn in mainline_nodes:
-            for c in mn.children:
-                # treat children that are not part of the chosen mainline as variations
-                if c not in mainline_nodes:
-                    var_parts.append("(" + self._serialize_subtree(c) + ")")
-        return mainline + "".join(var_parts)
+        return "".join(parts), tuple(variations)
 
     def to_sgf(self) -> str:
         """
         Serialize the GameTree to SGF text.
-        - If the synthetic root has a single top-level child, serialize that child wrapped in parentheses.
-        - If multiple top-level children exist, serialize each as a parenthesized tree concatenated.
+        - Each top-level child of the synthetic root is serialized as a parenthesized tree;
+          multiple trees are concatenated.
+        The result is cached until a node is mutated (see _TreeState.generation) or touch() is called.
         """
-        print("[DBG to_sgf] called for instance id", id(self), "root id", id(self.root))
-        top_children = self.root.children
-        if not top_children:
-            return ""
-        if len(top_children) == 1:
-            return "(" + self._serialize_subtree(top_children[0]) + ")"
-        parts: List[str] = []
-        for ch in top_children:
-            parts.append("(" + self._serialize_subtree(ch) + ")")
-        return "".join(parts)
+        # no node changes while the text (and the per-subtree caches) are built
+        root = self.root
+        state = root._state
+        with state.lock:
+            cache = self._sgf_cache
+            if cache is not None and cache[0] == state.generation and cache[1] is root:
+                return cache[2]
+            # every top-level tree goes into one buffer, joined once
+            out: List[str] = []
+            for ch in root.children:
+                out.append("(")
+                self._write_subtree(ch, out)
+                out.append(")")
+            sgf = "".join(out)
+            self._sgf_cache = (state.generation, root, sgf)
+            return sgf
+
+    def iter_sgf(self) -> Iterator[str]:
+        """
+        Yield the SGF text of the GameTree in pieces; "".join(iter_sgf()) == to_sgf().
+        A piece is at most one variation's mainline (or a "(" / ")"): text already cached by
+        to_sgf is reused, nothing new is cached. Do not mutate the tree while iterating.
+        """
+        cache = self._sgf_cache
+        if cache is not None and cache[0] == self.root._state.generation and cache[1] is self.root:
+            yield cache[2]
+            return
+        for ch in self.root.children:
+            yield "("
+            # same walk as _write_subtree, without storing _sgf_cache
+            stack: List[Any] = [ch]
+            while stack:
+                item = stack.pop()
+                if isinstance(item, str):
+                    yield item
+                    continue
+                cached = item._sgf_cache
+                text, variations = cached if cached is not None else self._serialize_mainline(item)
+                yield text
+                for c in reversed(variations):
+                    stack.append(")")
+                    stack.append(c)
+                    stack.append("(")
+            yield ")"
+
+    def write_sgf(self, fp) -> None:
+        """
+        Write the SGF text to a text file object piece by piece (see iter_sgf), without building
+        the whole string. The tree lock is held for the whole write, so Node mutators from other
+        threads wait for it. fp is written as it goes: an error part way leaves a partial file.
+        """
+        with self.root._state.lock:
+            for chunk in self.iter_sgf():
+                fp.write(chunk)
 
     #
     # Missing game props
@@ -486,114 +912,41 @@ class GameTree:
             return
 
         # If root already has children, we leave structure as-is
-        if getattr(self.root, "children", None):
+        if self.root.children:
             if DEBUG:
                 print("[TreeAdapter] load: root already has children:", len(self.root.children))
             return
 
-        # read defaults: prefer pyproject.toml project.name and project.version
-        defaults = self._defaults_from_pyproject()
-
-        # create a Node under synthetic root with canonical game properties
-        try:
-            node = Node(parent=self.root, is_variation=False)
-        except TypeError:
-            # older Node signature may not accept is_variation
-            node = Node(parent=self.root)
-
-        # canonical order of properties in SGF header
-        order = ["GM", "FF", "CA", "AP", "KM", "SZ", "DT"]
-        for k in order:
-            v = defaults.get(k)
-            if v is None:
-                continue
-            # append as single property entry preserving order
-            node.props.append((k, [v]))
-
-        # attach node to synthetic root
-        root.children.append(node)
-        node.parent = root
+        # read defaults (prefer pyproject.toml project.name and project.version)
+        # and attach a game node with them under the synthetic root
+        node = self._add_game_node()
 
         if DEBUG:
             print("[TreeAdapter] load: created default game node under synthetic root with props:", node.props)
 
-    def _defaults_from_pyproject(self, path: str = "../pyproject.toml") -> dict:
-        """
-        Try to read project.name and project.version from pyproject.toml.
-        Fallback to sensible defaults if file not found or parsing fails.
-        Returns dict with keys: GM, FF, CA, AP, KM, SZ, DT
-        Note: GM is set to "<name> <version>" if available, else "1".
-        AP is set to "name:version" if available, else "ggo:0.1".
-        DT is current UTC date YYYY-MM-DD.
-        """
-        defaults = {}
-        name, version = get_name_and_version_from_toml_path(path)
-
-        # build defaults
-        if name and version:
-            ap_val = f"{name}:{version}"
-        elif name:
-            ap_val = f"{name}:0.0"
-        else:
-            ap_val = "ggo:0.1"
-
-        defaults["GM"] = "1"  # str(gm_val)
-        defaults["FF"] = "4"
-        defaults["CA"] = "UTF-8"
-        defaults["AP"] = ap_val
-        defaults["KM"] = "6.5"
-        defaults["SZ"] = "19"
-        # UTC date
-        try:
-            dt = datetime.now(timezone.utc).date().isoformat()
-            defaults["DT"] = dt
-        except Exception:
-            defaults["DT"] = ""
-
-        if DEBUG:
-            print("[TreeAdapter] defaults_from_pyproject:", defaults, "pyproject read name/version:", name, version)
-
-        return defaults
+    def _add_game_node(self, path: str = "../pyproject.toml") -> Node:
+        """Create a game node with the canonical header props and attach it under the synthetic root."""
+        node = Node(parent=self.root, is_variation=False)
+        # canonical order of properties in SGF header; only the date changes between calls
+        node.props.extend(_get_header(path))
+        node.props.append(("DT", (_utc_date(),)))
+        self.root._add_child(node)
+        return node
 
     def add_missing_game_props_1(self, path: str = "../pyproject.toml") -> Node:
-        root = self.root
-        # build defaults (minimal): GM from pyproject (name+version) if available, else "1"
-        name, version = get_name_and_version_from_toml_path(path)
-
-        if name and version:
-            ap = f"{name}:{version}"
-        elif name:
-            ap = f"{name}:0.0"
-        else:
-            ap = "ggo:0.1"
-
-        # create the game node and attach to root
-        try:
-            game_node = Node(parent=root, is_variation=False)
-        except TypeError:
-            game_node = Node(parent=root)
-        # canonical header props
-        from datetime import datetime, timezone
-        dt = datetime.now(timezone.utc).date().isoformat()
-        header_order = [("GM", ["1"]), ("FF", ["4"]), ("CA", ["UTF-8"]), ("AP", [ap]), ("KM", ["6.5"]),
-                        ("SZ", ["19"]), ("DT", [dt])]
-        for k, vals in header_order:
-            game_node.props.append((k, list(vals)))
-        root.children.append(game_node)
-        game_node.parent = root
-        parent = game_node
-        return parent
+        # unconditionally add a game node with the default header; returns it as the new parent
+        return self._add_game_node(path)
 
     def need_game_node(self) -> bool:
         root: Node = self.root
         need_game_node = False
-        if not getattr(root, "children", []):
+        if not root.children:
             need_game_node = True
         else:
             first = root.children[0]
             # check if first child has a move (B/W)
             has_move = False
-            for k, vals in getattr(first, "props", []):
+            for k, vals in first.props:
                 if k in ("B", "W") and vals:
                     has_move = True
                     break
@@ -607,13 +960,17 @@ class GameTree:
     # Normalization, accend, decend
     #
     def walk(self, fn: Callable[[Node], None], node: Node):
-        fn(node)
-        while len(node.children or []) == 1:
-            node = node.children[0]
+        # pre-order with an explicit stack: single-child chains are followed inline,
+        # branches are pushed in reverse so they are visited in order
+        stack = [node]
+        while stack:
+            node = stack.pop()
             fn(node)
-        children = node.children or []
-        for child in children:
-            self.walk(fn, child)
+            while len(node.children) == 1:
+                node = node.children[0]
+                fn(node)
+            if node.children:
+                stack.extend(reversed(node.children))
 
     def walk_root(self, fn: Callable[[Node], None]):
         self.walk(fn, self.root)
@@ -640,9 +997,9 @@ class GameTree:
 
         def not_has_move(node: Node):
             nonlocal found_node
-            props_dict = node.props_dict()
-            for k in ['B', 'W', 'AB', 'AW']:
-                if k in props_dict and props_dict[k] and mv in props_dict[k]:
+            # scan props directly: repeated keys count like their merged props_dict values
+            for k, vals in node.props:
+                if (k == "B" or k == "W" or k == "AB" or k == "AW") and mv in vals:
                     found_node = node
                     return False
             return True
@@ -658,16 +1015,16 @@ class GameTree:
             node = child
 
     def get_current_child(self, node: Node) -> Node | None:
-        current_children = [
-            child
-            for child in node.children
-            if child.is_current
-        ]
-        assert len(current_children) <= 1, current_children
-        if not current_children:
-            return None
-        else:
-            return current_children[0]
+        # kept by the Node.is_current setter, no scan over the children
+        if DEBUG:
+            current_children = [
+                child
+                for child in node.children
+                if child.is_current
+            ]
+            assert len(current_children) <= 1, current_children
+            assert node._current_child is (current_children[0] if current_children else None)
+        return node._current_child
 
     def _sync_is_current(self, node: Node):
         if node.is_current:
@@ -710,6 +1067,8 @@ class GameTree:
 
     def clear(self):
         self.root = Node(parent=None)
+        self._path_cache = None
+        self._last_mainline = None
 
     #
     # Setting current, subscribe, unsubscribe
@@ -729,14 +1088,10 @@ class GameTree:
 
     def subscribe(self, cb):
         """cb(event_name: str, payload)"""
-        if cb not in self._subs:
-            self._subs.append(cb)
+        self._subs.setdefault(cb, None)
 
     def unsubscribe(self, cb):
-        try:
-            self._subs.remove(cb)
-        except ValueError:
-            pass
+        self._subs.pop(cb, None)
 
     def _emit(self, event, payload):
         for cb in list(self._subs):
@@ -783,16 +1138,10 @@ class GameTree:
             return self.root
 
     def get_current_path(self) -> List[Node]:
-        path = []
         if self._current is None:
-            return path
-
-        def ascend_to_root_child_fn(node: Node) -> bool:
-            path.append(node)
-            return True
-
-        self.ascend(ascend_to_root_child_fn, self._current)
-        path.reverse()
+            return []
+        # ascend phase: root child .. current, shared with get_node_path's cache
+        path = self.get_node_path(self._current)
 
         def descend_to_current_leaf_fn(node: Node):
             if not node.is_current:
@@ -863,28 +1212,34 @@ if __name__ == "__main__":
 
 
     def traverse_mainline(node: Optional[Node], depth=0):
-        if node is None:
-            return
-        pd = node.props_dict()
-        mv = None
-        if "B" in pd:
-            mv = f"B {pd['B']}"
-        elif "W" in pd:
-            mv = f"W {pd['W']}"
-        print("Mainline move:", mv, "props:", pd)
-        # follow mainline child (first non-variation child)
-        main_child = None
-        for c in node.children:
-            if not getattr(c, "_is_variation", False):
-                main_child = c
-                break
-        if main_child:
-            traverse_mainline(main_child, depth + 1)
-        # print variations
-        for v in node.children:
-            if v is not main_child:
-                print("Variation at node:", node, "->", v)
-                traverse_mainline(v, depth + 1)
+        # pre-order with an explicit stack (deep games would hit the recursion limit):
+        # ("node", n, depth) prints n and schedules its subtree,
+        # ("var", parent, v, depth) announces variation v before descending into it
+        stack: List[Tuple[Any, ...]] = [("node", node, depth)]
+        while stack:
+            item = stack.pop()
+            if item[0] == "var":
+                _, parent, v, d = item
+                print("Variation at node:", parent, "->", v)
+                stack.append(("node", v, d))
+                continue
+            _, node, d = item
+            if node is None:
+                continue
+            pd = node.props_dict()
+            mv = None
+            if "B" in pd:
+                mv = f"B {pd['B']}"
+            elif "W" in pd:
+                mv = f"W {pd['W']}"
+            print("Mainline move:", mv, "props:", pd)
+            # follow mainline child (first non-variation child) first, then the variations in order
+            main_child = node._mainline_child
+            for v in reversed(node.children):
+                if v is not main_child:
+                    stack.append(("var", node, v, d + 1))
+            if main_child:
+                stack.append(("node", main_child, d + 1))
 
 
     for ch in root.children:
@@ -0,0 +1,233 @@
+# tests/test_game_tree.py
+import io
+
+from ggo.game_tree import GameTree, Node, iter_sgf_events
+
+SAMPLE = "(;GM[1]FF[4]CA[UTF-8]AP[Sabaki:0.52.2]KM[6.5]SZ[19]DT[2025-12-09];B[pd](;W[dp];B[pp];W[dd])(;W[pp];B[dp];W[dd]))"
+
+
+def test_sgf_roundtrip_with_variations():
+    gt = GameTree()
+    gt.load_sgf_simple(SAMPLE)
+    assert gt.to_sgf() == SAMPLE
+    game = gt.root.children[0]
+    assert game.get_prop("SZ") == ("19",)
+    assert len(game.children[0].children) == 2
+
+
+def test_escaped_values_and_whitespace():
+    gt = GameTree()
+    gt.load_sgf_simple("(;C[a \\] b \\\\ c]\n  AB [aa] [bb]\n;W[cc])")
+    game = gt.root.children[0]
+    assert game.get_prop("C") == ("a ] b \\ c",)
+    assert game.get_prop("AB") == ("aa", "bb")
+    assert gt.to_sgf() == "(;C[a \\] b \\\\ c]AB[aa][bb];W[cc])"
+
+
+def test_get_prop_sees_set_prop_and_add_prop_value():
+    gt = GameTree()
+    gt.load_sgf_simple("(;B[aa]C[x])")
+    node = gt.root.children[0]
+    assert node.get_prop("GGNV") is None
+    assert node.props_dict() == {"B": ["aa"], "C": ["x"]}
+    node.set_prop("GGNV", ["100"])
+    assert node.get_prop("GGNV") == ("100",)
+    node.add_prop_value("TR", "bb")
+    assert node.get_prop("TR") == ("bb",)
+    assert node.props_dict() == {"B": ["aa"], "C": ["x"], "GGNV": ["100"], "TR": ["bb"]}
+    node.props_dict()["B"].append("zz")
+    assert node.get_prop("B") == ("aa",) and node.props_dict()["B"] == ["aa"]
+    assert node.has_move()
+
+
+def test_deeply_nested_variations_serialize():
+    sgf = "(;B[aa]" + "(;W[bb]" * 2000 + ")" * 2000 + ")"
+    gt = GameTree()
+    gt.load_sgf_simple(sgf)
+    assert gt.to_sgf() == sgf
+
+
+def test_to_sgf_cache_follows_mutations():
+    gt = GameTree()
+    gt.load_sgf_simple("(;B[aa])")
+    assert gt.to_sgf() == "(;B[aa])"
+    node = gt.root.children[0]
+    node.set_prop("C", ["hi"])
+    assert gt.to_sgf() == "(;B[aa]C[hi])"
+    gt.add_move(node, "W", "bb")
+    assert gt.to_sgf() == "(;B[aa]C[hi];W[bb])"
+    gt.load_sgf_simple("(;B[cc])")
+    assert gt.to_sgf() == "(;B[aa]C[hi];W[bb])(;B[cc])"
+
+
+def test_mainline_and_node_path_follow_variation_flags():
+    gt = GameTree()
+    gt.load_sgf_simple(SAMPLE)
+    first = gt.root.children[0].children[0]
+    main, alt = first.children
+    assert gt.find_last_mainline_node() is first
+    assert gt.get_node_path(main.children[0]) == [gt.root.children[0], first, main, main.children[0]]
+    alt.set_is_variation(False)
+    assert gt.find_last_mainline_node() is alt.children[0].children[0]
+    main.set_is_variation(False)
+    assert gt.find_last_mainline_node() is main.children[0].children[0]
+    assert GameTree().get_node_path(main) == []
+
+
+def test_iter_sgf_events_streams_without_nodes():
+    events = list(iter_sgf_events("(;SZ[9];B[aa]C[x\\]y](;W[bb])(;W[cc]))"))
+    assert events == [
+        ("open_var",), ("node",), ("prop", "SZ", ("9",)),
+        ("node",), ("prop", "B", ("aa",)), ("prop", "C", ("x]y",)),
+        ("open_var",), ("node",), ("prop", "W", ("bb",)), ("close_var",),
+        ("open_var",), ("node",), ("prop", "W", ("cc",)), ("close_var",),
+        ("close_var",),
+    ]
+
+
+def test_iter_sgf_events_skips_stray_brackets():
+    assert list(iter_sgf_events("(;B[aa])[;W[bb]]")) == [
+        ("open_var",), ("node",), ("prop", "B", ("aa",)), ("close_var",),
+        ("node",), ("prop", "W", ("bb",)),
+    ]
+    assert list(iter_sgf_events("([x];C[y])")) == [
+        ("open_var",), ("node",), ("prop", "C", ("y",)), ("close_var",),
+    ]
+
+
+def test_add_move_raw_props():
+    gt = GameTree()
+    gt.load_sgf_simple("(;SZ[19])")
+    game = gt.root.children[0]
+    node = gt.add_move(game, "B", "pd", raw_props=[("C", ("hi",)), ("TR", ("aa", "bb"))])
+    assert node.props == [("B", ("pd",)), ("C", ("hi",)), ("TR", ("aa", "bb"))]
+    assert gt.to_sgf() == "(;SZ[19];B[pd]C[hi]TR[aa][bb])"
+
+
+def test_add_missing_game_props_creates_header_once():
+    gt = GameTree()
+    gt.add_missing_game_props()
+    (game,) = gt.root.children
+    assert [k for k, _ in game.props] == ["GM", "FF", "CA", "AP", "KM", "SZ", "DT"]
+    assert game.get_prop("SZ") == ("19",)
+    gt.add_missing_game_props()
+    assert len(gt.root.children) == 1
+    node = gt.add_missing_game_props_1()
+    assert gt.root.children[1] is node and node.parent is gt.root
+
+
+def test_flags_are_independent():
+    node = Node(is_variation=True)
+    assert node._is_variation and not node.is_current
+    node.is_current = True
+    node._is_variation = False
+    assert node.is_current and not node._is_variation
+    node.is_current = False
+    assert not node.is_current and not node._is_variation
+
+
+def test_get_node_path_reuses_cached_prefix_safely():
+    gt = GameTree()
+    gt.load_sgf_simple(SAMPLE)
+    game = gt.root.children[0]
+    first = game.children[0]
+    main, alt = first.children
+    leaf = main.children[0].children[0]
+    path = gt.get_node_path(leaf)
+    assert path == [game, first, main, main.children[0], leaf]
+    path.append(alt)
+    assert gt.get_node_path(main) == [game, first, main]
+    assert gt.get_node_path(alt.children[0]) == [game, first, alt, alt.children[0]]
+    gt.clear()
+    assert gt.get_node_path(leaf) == []
+
+
+def test_to_sgf_reuses_and_invalidates_variation_subtrees():
+    gt = GameTree()
+    gt.load_sgf_simple(SAMPLE)
+    assert gt.to_sgf() == SAMPLE
+    main, alt = gt.root.children[0].children[0].children
+    alt.children[0].set_prop("C", ["x"])
+    text = gt.to_sgf()
+    assert text == SAMPLE.replace(";B[dp];W[dd])", ";B[dp]C[x];W[dd])")
+    assert gt.to_sgf() is text
+    main.children[0].set_prop("C", ["y"])
+    assert gt.to_sgf() == text.replace(";B[pp];W[dd])", ";B[pp]C[y];W[dd])")
+    main._is_variation = False
+    assert gt.to_sgf().endswith(";B[pd];W[dp];B[pp]C[y];W[dd](;W[pp];B[dp]C[x];W[dd]))")
+
+
+def test_get_current_child_follows_current_switches():
+    gt = GameTree()
+    gt.load_sgf_simple(SAMPLE)
+    first = gt.root.children[0].children[0]
+    main, alt = first.children
+    gt.current = alt.children[0]
+    assert gt.get_current_child(first) is alt
+    assert gt.get_current_child(alt.children[0]) is alt.children[0].children[0]
+    gt.current = main
+    assert gt.get_current_child(first) is main
+    assert gt.get_current_child(alt) is None and not alt.is_current
+
+
+def test_write_sgf_streams_pieces():
+    gt = GameTree()
+    gt.load_sgf_simple(SAMPLE + "(;B[aa])")
+    pieces = list(gt.iter_sgf())
+    assert pieces[:3] == ["(", ";GM[1]FF[4]CA[UTF-8]AP[Sabaki:0.52.2]KM[6.5]SZ[19]DT[2025-12-09];B[pd]", "("]
+    fp = io.StringIO()
+    gt.write_sgf(fp)
+    assert fp.getvalue() == "".join(pieces) == gt.to_sgf() == SAMPLE + "(;B[aa])"
+    assert list(gt.iter_sgf()) == [SAMPLE + "(;B[aa])"]
+
+
+def test_build_index_keeps_an_installed_index():
+    node = Node()
+    node.set_prop("B", ["aa"])
+    index = node._index
+    # a reader that started building before set_prop installed its index must not replace it
+    assert node._build_index() is index
+    node.set_prop("GGNV", ["1"])
+    assert node.get_prop("GGNV") == ("1",)
+    assert [k for k, _ in node.props] == ["B", "GGNV"]
+
+
+def test_stray_brackets_are_skipped_like_single_chars():
+    gt = GameTree()
+    gt.load_sgf_simple("(;B[aa])[;W[bb]]")
+    assert gt.to_sgf() == "(;B[aa])(;W[bb])"
+    gt = GameTree()
+    gt.load_sgf_simple("(C[x;W[bb]];B[cc])")
+    assert gt.to_sgf() == "(;W[bb];B[cc])"
+
+
+def test_unchanged_variation_flags_keep_the_sgf_cache():
+    gt = GameTree()
+    gt.load_sgf_simple(SAMPLE)
+    gt.normalize_is_variation()
+    text = gt.to_sgf()
+    gt.normalize_is_variation()
+    assert gt.to_sgf() is text
+
+
+def test_parsed_coordinates_are_shared_between_trees():
+    first, second = GameTree(), GameTree()
+    first.load_sgf_simple("(;B[pd]C[?!])")
+    second.load_sgf_simple("(;W[pd]C[?!])")
+    assert first.root.children[0].get_prop("B")[0] is second.root.children[0].get_prop("W")[0]
+    assert first.root.children[0].get_prop("C") == second.root.children[0].get_prop("C") == ("?!",)
+
+
+def test_sgf_cache_is_per_tree():
+    first, second = GameTree(), GameTree()
+    first.load_sgf_simple("(;B[aa])")
+    second.load_sgf_simple("(;B[bb])")
+    text = second.to_sgf()
+    first.root.children[0].set_prop("C", ["x"])
+    assert second.to_sgf() is text
+    # a node built on its own joins the tree it is attached to
+    node = Node()
+    node._add_child(Node(parent=node))
+    second.root.children[0]._add_child(node)
+    node.children[0].set_prop("W", ["cc"])
+    assert second.to_sgf() == "(;B[bb];;W[cc])"
@@ -44,7 +44,7 @@ class TreeAdapter:
         cur = node
         while cur is not None:
             path.append(cur)
-            cur = getattr(cur, "parent", None)
+            cur = cur.parent
         path.reverse()
         return path
 
@@ -94,15 +94,9 @@ class TreeAdapter:
         if not self.get_game_tree() or not self.get_game_tree().root.children:
             return None
         cur = self.get_game_tree().root.children[0]
-        while True:
-            next_child = None
-            for c in getattr(cur, "children", []):
-                if not getattr(c, "_is_variation", False):
-                    next_child = c
-                    break
-            if next_child is None:
-                return cur
-            cur = next_child
+        while cur._mainline_child is not None:
+            cur = cur._mainline_child
+        return cur
 
     def collect_ab_aw(self) -> List[Tuple[str, Tuple[int, int]]]:
         """
@@ -116,7 +110,7 @@ class TreeAdapter:
         root = self.get_game_tree().root
 
         def collect(node):
-            for k, vals in getattr(node, "props", []):
+            for k, vals in node.props:
                 if k == "AB":
                     for v in vals:
                         stones.append(("B", v))
@@ -140,10 +134,6 @@ class TreeAdapter:
         cur = start
         while cur is not None:
             res.append(cur)
-            next_child = None
-            for c in getattr(cur, "children", []):
-                if not getattr(c, "_is_variation", False):
-                    next_child = c
-                    break
-            cur = next_child
+            # first non-variation child, cached on the node
+            cur = cur._mainline_child
         return res